@@ -7,36 +7,414 @@ Mise en situation – Traitement de données en Python
 2. Nettoyage & Typage
 3. Jointure & Analyse
 4. Sauvegarde
+
+Exécution GPU (optionnelle) : avec la variable d'environnement
+`USE_GPU=1` (ou `true` / `yes`, sans distinction de casse), les
+opérations pandas sont exécutées par cuDF (`cudf.pandas`, installé
+séparément). Toute autre valeur (`0`, `false`, ...) laisse pandas sur CPU.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Iterator
+import atexit
+import functools
+import gzip
+import io
+import itertools
 import logging
+import os
+import queue
+import zipfile
+
+# cuDF doit être installé avant l'import de pandas
+if os.environ.get("USE_GPU", "").strip().lower() in {"1", "true", "yes"}:
+    import cudf.pandas
+    cudf.pandas.install()
+
 import pandas as pd
 import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+# Racine du projet, résolue une seule fois à l'import
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+# Marqueurs de valeurs manquantes reconnus à la lecture des CSV : ceux de
+# `pandas.read_csv` par défaut
+NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a",
+    "nan", "null",
+]
+
+# Nombre de lignes à partir duquel les noyaux Numba sont utilisés : en
+# dessous, le coût de compilation / chargement dépasse le gain. C'est aussi
+# la taille minimale de la tranche confiée à chaque thread.
+NUMBA_MIN_ROWS = 100_000
+
+# Taille (en octets) des blocs lus dans le fichier consultations
+CSV_BLOCK_SIZE = 1 << 24
+
+# Nombre maximal de lignes par groupe de lignes des fichiers Parquet
+PARQUET_ROW_GROUP_SIZE = 262_144
+
+CONSULTATIONS_COLUMNS = ["consultation_id", "patient_id", "date_consultation", "diagnostic"]
+
+# Schéma Arrow du fichier consultations.parquet, fixé avant l'écriture
+# du premier bloc
+CONSULTATIONS_SCHEMA = pa.schema([
+    ("consultation_id", pa.large_string()),
+    ("patient_id", pa.large_string()),
+    ("date_consultation", pa.timestamp("ns")),
+    ("diagnostic", pa.dictionary(pa.int32(), pa.string())),
+])
 
 
 def setup_logging(log_path: Path) -> None:
-    """Configure le logging (fichier + console)."""
+    """Configure le logging (fichier + console).
+
+    Les messages passent par une file : les écritures (fichier, console)
+    sont faites par un thread dédié et ne bloquent pas le traitement.
+    Sans effet si le logging est déjà configuré (appels répétés).
+    """
+    if logging.getLogger().hasHandlers():
+        return
+
     log_path.parent.mkdir(parents=True, exist_ok=True)
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s | %(levelname)s | %(message)s",
-        handlers=[
-            logging.FileHandler(log_path, encoding="utf-8"),
-            logging.StreamHandler(),
-        ],
+    formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
+    handlers = [
+        logging.FileHandler(log_path, encoding="utf-8"),
+        logging.StreamHandler(),
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    # Vide la file et ferme les handlers en fin d'exécution
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(QueueHandler(log_queue))
+
+
+def clean_identifier(column: str) -> pl.Expr:
+    """Expression Polars de nettoyage d'une colonne d'identifiants.
+
+    Supprime les espaces et remplace les chaînes vides par des valeurs
+    nulles ; évaluée dans le plan d'exécution différé de la lecture.
+    """
+    return pl.col(column).str.strip_chars().replace("", None)
+
+
+def remove_category(serie: pd.Series, valeur: str) -> pd.Series:
+    """Remplace une modalité non-signifiante d'une colonne catégorielle par NaN.
+
+    La modalité est retirée des catégories (codes correspondants mis à -1)
+    au lieu de remplacer les valeurs puis de reconstruire la catégorielle.
+    """
+    if valeur not in serie.cat.categories:
+        return serie
+    return serie.cat.remove_categories([valeur])
+
+
+def hash_identifier(serie: pd.Series) -> np.ndarray:
+    """Empreinte `uint64` de chaque identifiant d'une colonne.
+
+    Le hachage est fait par Polars directement sur le tampon Arrow (sans
+    objet Python par ligne) et calculé une seule fois par ligne : les tests
+    d'appartenance comparent ensuite des entiers plutôt que des chaînes.
+    """
+    return pl.from_arrow(pa.array(serie)).hash().to_numpy()
+
+
+@functools.cache
+def numba_kernels() -> SimpleNamespace | None:
+    """Importe Numba et définit les noyaux compilés, au premier appel.
+
+    L'import (et la compilation) n'est donc payé que si un bloc atteint
+    `NUMBA_MIN_ROWS` lignes. Renvoie None si Numba n'est pas installé.
+    """
+    try:
+        import numba
+    except ImportError:  # Numba est optionnel : repli sur pandas / NumPy
+        return None
+
+    @numba.njit(cache=True)
+    def build_hash_table(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Table de hachage à adressage ouvert (capacité 2^k ≥ 2 × N)."""
+        capacity = 1
+        while capacity < 2 * keys.size:
+            capacity <<= 1
+        table_keys = np.zeros(capacity, dtype=np.uint64)
+        table_used = np.zeros(capacity, dtype=np.bool_)
+        mask = np.uint64(capacity - 1)
+        for h in keys:
+            j = h & mask
+            while table_used[j] and table_keys[j] != h:
+                j = (j + np.uint64(1)) & mask
+            table_keys[j] = h
+            table_used[j] = True
+        return table_keys, table_used
+
+    @numba.njit(cache=True, parallel=True)
+    def probe_hash_table(
+        keys: np.ndarray, table_keys: np.ndarray, table_used: np.ndarray
+    ) -> np.ndarray:
+        """Teste, en parallèle, la présence de chaque clé dans la table."""
+        out = np.empty(keys.size, dtype=np.bool_)
+        mask = np.uint64(table_keys.size - 1)
+        for i in numba.prange(keys.size):
+            h = keys[i]
+            j = h & mask
+            found = False
+            while table_used[j]:
+                if table_keys[j] == h:
+                    found = True
+                    break
+                j = (j + np.uint64(1)) & mask
+            out[i] = found
+        return out
+
+    @numba.njit(cache=True, parallel=True)
+    def count_by_key(
+        keys: np.ndarray, vals: np.ndarray, size: int, n_parts: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Nombre de lignes et somme de `vals` par clé, en un seul passage.
+
+        Chaque thread compte sur sa propre portion du tableau (pas d'écriture
+        concurrente sur un même compteur), les comptes sont sommés ensuite.
+        """
+        totals = np.zeros((n_parts, size), dtype=np.int64)
+        sums = np.zeros((n_parts, size), dtype=np.int64)
+        step = (keys.size + n_parts - 1) // n_parts
+        for p in numba.prange(n_parts):
+            for i in range(p * step, min((p + 1) * step, keys.size)):
+                k = keys[i]
+                totals[p, k] += 1
+                sums[p, k] += vals[i]
+        return totals.sum(axis=0), sums.sum(axis=0)
+
+    return SimpleNamespace(
+        build_hash_table=build_hash_table,
+        probe_hash_table=probe_hash_table,
+        count_by_key=count_by_key,
+        get_num_threads=numba.get_num_threads,
+    )
+
+
+def count_by_key(
+    keys: np.ndarray, vals: np.ndarray, minlength: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    """Nombre de lignes et somme de `vals` (0/1) pour chaque clé entière.
+
+    Pour les blocs d'au moins `NUMBA_MIN_ROWS` lignes (et si Numba est
+    disponible), un noyau compilé et parallèle fait le décompte en un seul
+    passage ; sinon, deux `np.bincount`.
+    """
+    size = max(int(keys.max()) + 1 if keys.size else 0, minlength)
+    kernels = numba_kernels() if keys.size >= NUMBA_MIN_ROWS else None
+    if kernels is not None:
+        # Un thread par tranche d'au moins `NUMBA_MIN_ROWS` lignes
+        n_parts = max(1, min(kernels.get_num_threads(), keys.size // NUMBA_MIN_ROWS))
+        return kernels.count_by_key(keys, vals, size, n_parts)
+
+    return (
+        np.bincount(keys, minlength=size),
+        np.bincount(keys, weights=vals, minlength=size).astype(np.int64),
+    )
+
+
+def membership_test(valid_hashes: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+    """Construit le test d'appartenance à un ensemble d'empreintes `uint64`.
+
+    Pour les blocs d'au moins `NUMBA_MIN_ROWS` lignes (et si Numba est
+    disponible), la table de hachage est construite au premier besoin puis
+    sondée par un noyau compilé et parallèle ; sinon, `Index.isin`.
+    """
+    valid_ids = pd.Index(valid_hashes)
+    table = None
+
+    def is_member(keys: np.ndarray) -> np.ndarray:
+        nonlocal table
+        kernels = numba_kernels() if keys.size >= NUMBA_MIN_ROWS else None
+        if kernels is None:
+            return pd.Index(keys).isin(valid_ids)
+        if table is None:
+            table = kernels.build_hash_table(valid_hashes)
+        return kernels.probe_hash_table(keys, *table)
+
+    return is_member
+
+
+def read_patients_csv(path: Path) -> bytes:
+    """Lit le fichier patients (gzip) et le réencode en UTF-8.
+
+    Le lecteur différé de Polars n'accepte que l'UTF-8 et ne gère pas le
+    gzip : le fichier est décompressé et réencodé en mémoire au préalable.
+    """
+    with gzip.open(path) as f:
+        return f.read().decode("latin-1").encode("utf-8")
+
+
+def read_consultations(path: Path) -> Iterator[pa.RecordBatch]:
+    """Lit le fichier consultations (zip) par blocs successifs.
+
+    Le membre de l'archive est décompressé et décodé (latin-1) au fil de
+    la lecture : la mémoire utilisée reste proportionnelle à la taille
+    d'un bloc et non à celle du fichier.
+    """
+    with zipfile.ZipFile(path) as archive:
+        with archive.open(archive.namelist()[0]) as f:
+            reader = pv.open_csv(
+                f,
+                read_options=pv.ReadOptions(
+                    encoding="latin-1", block_size=CSV_BLOCK_SIZE
+                ),
+                convert_options=pv.ConvertOptions(
+                    include_columns=CONSULTATIONS_COLUMNS,
+                    column_types={c: pa.string() for c in CONSULTATIONS_COLUMNS},
+                    null_values=NA_VALUES,
+                    strings_can_be_null=True,
+                ),
+            )
+            yield from reader
+
+
+def clean_consultations(batch: pa.RecordBatch) -> pd.DataFrame:
+    """Nettoie et type un bloc de la table consultations."""
+    # Nettoyage de l'identifiant et conversion de la date (Polars) ; les
+    # valeurs non-signifiantes ("not_a_date", "N/ A") deviennent nulles.
+    df = pl.from_arrow(batch).with_columns(
+        clean_identifier("consultation_id"),
+        pl.col("date_consultation").str.strptime(
+            pl.Datetime("ns"), "%d/%m/%Y", strict=False
+        ),
+    ).to_pandas(use_pyarrow_extension_array=True)
+
+    # Typage
+
+    # Identifiant de consultation : chaîne de caractères
+    # Identifiant patient : chaîne de caractères (clé de jointure)
+    # Date de consultation : datetime
+    # (déjà typés ci-dessus)
+    # Diagnostic : variable catégorielle
+    df["diagnostic"] = df["diagnostic"].astype("category")
+
+    # Nettoyage des valeurs non-signifiantes
+
+    df["diagnostic"] = remove_category(df["diagnostic"], "nnull")
+
+    # ============================================================
+    # Justification des types – table consultations
+    # ============================================================
+
+    # consultation_id -> string
+    # Le champ `consultation_id` est un identifiant unique de consultation.
+    # Il n’est pas destiné à des calculs numériques mais à des comparaisons
+    # et des jointures. Le type `string` permet de conserver l’intégrité
+    # de l’identifiant (y compris d’éventuels zéros ou caractères
+    # alphanumériques) et garantit une jointure fiable avec la table
+    # `patients`.
+
+    # patient_id -> string
+    # Le champ `patient_id` est utilisé comme clé de jointure avec la table
+    # `patients`. Il est typé en `string` pour assurer la cohérence de type
+    # entre les deux tables et éviter tout problème de jointure lié à des
+    # conversions implicites.
+
+    # date_consultation -> datetime
+    # La date de consultation est convertie en `datetime` afin de permettre
+    # l’extraction d’informations temporelles (mois, année) nécessaires
+    # à l’analyse.
+
+    # diagnostic -> category
+    # Le champ `diagnostic` correspond à un ensemble restreint de statuts
+    # ou de libellés. Le type `category` est approprié pour représenter
+    # ce type de variable qualitative et facilite les analyses descriptives
+    # ultérieures.
+
+    return df
+
+
+def consultations_parquet_schema() -> pa.Schema:
+    """Schéma d'écriture de consultations.parquet.
+
+    `CONSULTATIONS_SCHEMA` complété des métadonnées pandas d'un bloc vide
+    nettoyé, pour que `pd.read_parquet` restitue les types pandas.
+    """
+    empty = pa.RecordBatch.from_pylist(
+        [], schema=pa.schema([(c, pa.string()) for c in CONSULTATIONS_COLUMNS])
+    )
+    table = pa.Table.from_pandas(
+        clean_consultations(empty), schema=CONSULTATIONS_SCHEMA, preserve_index=False
+    )
+    return table.schema
+
+
+def diet(df: pd.DataFrame) -> pd.DataFrame:
+    """Réduit l'empreinte mémoire d'un DataFrame colonne par colonne.
+
+    - entiers : plus petit type entier (non signé si possible) ;
+    - chaînes peu variées (moins de 50 % de valeurs distinctes parmi les
+      valeurs renseignées) : type `category` ; les chaînes très variées
+      (identifiants) restent en chaînes Arrow.
+    """
+    for col in df.columns:
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.is_integer_dtype(serie.dtype):
+            if not serie.count():  # colonne entièrement vide
+                continue
+            downcast = "unsigned" if serie.dropna().min() >= 0 else "integer"
+            df[col] = pd.to_numeric(serie, downcast=downcast)
+        elif pd.api.types.is_string_dtype(serie.dtype):
+            if serie.nunique() < 0.5 * serie.count():
+                df[col] = serie.astype("category")
+    return df
+
+
+def write_parquet(
+    df: pd.DataFrame,
+    path: Path,
+    compression: str = "snappy",
+    row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+) -> None:
+    """Écrit un DataFrame en Parquet directement via `pyarrow.parquet`.
+
+    La mémoire Arrow inutilisée est rendue au système après l'écriture,
+    pour que les pics mémoire des écritures successives ne s'additionnent pas.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(
+        table,
+        path,
+        compression=compression,
+        use_dictionary=True,
+        row_group_size=row_group_size,
+        data_page_size=1 << 20,
+        write_statistics=False,
     )
+    del table
+    pa.default_memory_pool().release_unused()
 
 
 def main() -> None:
     # ============================================================
     # Définition des chemins
     # ============================================================
-    project_root = Path(__file__).resolve().parents[1]
-    inputs_dir = project_root / "inputs"
-    outputs_dir = project_root / "outputs"
-    logs_dir = project_root / "logs"
+    inputs_dir = PROJECT_ROOT / "inputs"
+    outputs_dir = PROJECT_ROOT / "outputs"
+    logs_dir = PROJECT_ROOT / "logs"
 
     setup_logging(logs_dir / "processing.log")
 
@@ -50,61 +428,68 @@ def main() -> None:
     patients_path = inputs_dir / "patients.csv.gz"
     consultations_path = inputs_dir / "consultations.csv.zip"
 
-    # Lecture du fichier patients (gzip)
-    df_patients = pd.read_csv(
-    patients_path,
-    compression="gzip",
-    encoding="latin-1"
-    )
-
-    # Lecture du fichier consultations (zip)
-    df_consultations = pd.read_csv(
-        consultations_path,
-        compression="zip",
-        encoding="latin-1"
-    )
+    # Lecture par blocs du fichier consultations (zip) : chaque bloc est
+    # nettoyé, analysé puis écrit en Parquet (étapes 2 à 4) avant la
+    # lecture du suivant.
+    consultations_batches = read_consultations(consultations_path)
+
+    # Les deux lectures sont indépendantes : la décompression du fichier
+    # patients et la lecture du premier bloc de consultations sont menées
+    # en parallèle (la décompression libère le GIL).
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        future_patients = executor.submit(read_patients_csv, patients_path)
+        future_consultations = executor.submit(
+            list, itertools.islice(consultations_batches, 1)
+        )
+        patients_csv = future_patients.result()
+        first_batches = future_consultations.result()
+        consultations_batches = itertools.chain(first_batches, consultations_batches)
+        # Le premier bloc n'est plus référencé que par la chaîne : il est
+        # libéré dès qu'il a été traité
+        del first_batches
 
-    logging.info(
-        "Lecture OK | patients=%s lignes | consultations=%s lignes",
-        len(df_patients),
-        len(df_consultations),
-    )
+    # Lecture du fichier patients (gzip)
+    # Lecture différée (LazyFrame Polars) : le fichier n'est analysé qu'à
+    # la collecte, en une seule exécution multithreadée fusionnée avec le
+    # nettoyage et le typage de l'étape 2.
+    lf_patients = pl.scan_csv(
+        io.BytesIO(patients_csv),
+        schema_overrides={"patient_id": pl.Utf8},
+        null_values=NA_VALUES,
+    ).select("patient_id", "birth_date", "gender")
 
     # ============================================================
     # 2. NETTOYAGE & TYPAGE
     # ============================================================
     logging.info("Étape 2 - Nettoyage et typage explicite")
 
-    logging.info("Colonnes patients: %s", list(df_patients.columns))
-    logging.info("Colonnes consultations: %s", list(df_consultations.columns))
-
     # --- Patients
 
-    # Nettoyage des valeurs non-signifiantes
-
-    df_patients["patient_id"] = (
-        df_patients["patient_id"]
-        .str.strip()         # supprime les espaces
-        .replace("", np.nan) # remplace les chaînes vides par NaN
-    )
+    # Nettoyage de l'identifiant et conversion de la date dans le plan
+    # différé ; les valeurs non-signifiantes de la date ("not_a_date",
+    # "N/ A") deviennent nulles (`strict=False`).
+    df_patients = lf_patients.with_columns(
+        clean_identifier("patient_id"),
+        pl.col("birth_date").str.strptime(pl.Datetime("ns"), "%Y-%m-%d", strict=False),
+    ).collect().to_pandas(use_pyarrow_extension_array=True)
 
-    df_patients["birth_date"] = df_patients["birth_date"].replace(
-        ["not_a_date", "N/ A"], np.nan
-    )   
+    logging.info("Lecture OK | patients=%s lignes", len(df_patients))
 
-    df_patients["gender"] = df_patients["gender"].replace("unknown", np.nan)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Colonnes patients: %s", list(df_patients.columns))
 
     # Typage explicite des colonnes
 
     # Identifiant patient : chaîne de caractères
-    df_patients["patient_id"] = df_patients["patient_id"].astype("string")
     # Date de naissance : datetime
-    df_patients["birth_date"] = pd.to_datetime(
-        df_patients["birth_date"]
-    )
+    # (déjà typés à la collecte du plan Polars)
     # Genre : variable catégorielle
     df_patients["gender"] = df_patients["gender"].astype("category")
 
+    # Nettoyage des valeurs non-signifiantes
+
+    df_patients["gender"] = remove_category(df_patients["gender"], "unknown")
+
     # ============================================================
     # Justification des types – table patients
     # ============================================================
@@ -127,65 +512,15 @@ def main() -> None:
     # sémantique de la variable et permet une optimisation mémoire par
     # rapport à un type texte classique.
 
+    # Réduction de l'empreinte mémoire dès le chargement
+    df_patients = diet(df_patients)
 
     # --- Consultations
-    
-    # Nettoyage des valeurs non-signifiantes
-
-    df_consultations["consultation_id"] = (
-        df_consultations["consultation_id"]
-        .str.strip()         # supprime les espaces
-        .replace("", np.nan)
-    )
-
-    df_consultations["date_consultation"] = df_consultations["date_consultation"].replace(
-        ["not_a_date", "N/ A"], np.nan
-    )
-
-    df_consultations["diagnostic"] = df_consultations["diagnostic"].replace("nnull", np.nan)
-
-    # Typage
-
-    # Identifiant de consultation : chaîne de caractères
-    df_consultations["consultation_id"] = df_consultations["consultation_id"].astype("string")
-    # Identifiant patient : chaîne de caractères (clé de jointure)
-    df_consultations["patient_id"] = df_consultations["patient_id"].astype("string")
-    # Date de consultation : datetime
-    df_consultations["date_consultation"] = pd.to_datetime(
-        df_consultations["date_consultation"],
-        format="%d/%m/%Y"
-    )
-    # Diagnostic : variable catégorielle
-    df_consultations["diagnostic"] = df_consultations["diagnostic"].astype("category")
+    # Nettoyage et typage bloc par bloc (voir `clean_consultations`)
 
-    # ============================================================
-    # Justification des types – table consultations
-    # ============================================================
-
-    # consultation_id -> string
-    # Le champ `consultation_id` est un identifiant unique de consultation.
-    # Il n’est pas destiné à des calculs numériques mais à des comparaisons
-    # et des jointures. Le type `string` permet de conserver l’intégrité
-    # de l’identifiant (y compris d’éventuels zéros ou caractères
-    # alphanumériques) et garantit une jointure fiable avec la table
-    # `patients`.
-
-    # patient_id -> string
-    # Le champ `patient_id` est utilisé comme clé de jointure avec la table
-    # `patients`. Il est typé en `string` pour assurer la cohérence de type
-    # entre les deux tables et éviter tout problème de jointure lié à des
-    # conversions implicites.
-
-    # date_consultation -> datetime
-    # La date de consultation est convertie en `datetime` afin de permettre
-    # l’extraction d’informations temporelles (mois, année) nécessaires
-    # à l’analyse.
-
-    # diagnostic -> category
-    # Le champ `diagnostic` correspond à un ensemble restreint de statuts
-    # ou de libellés. Le type `category` est approprié pour représenter
-    # ce type de variable qualitative et facilite les analyses descriptives
-    # ultérieures.
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        # Colonnes fixées à la lecture (`include_columns`)
+        logging.debug("Colonnes consultations: %s", CONSULTATIONS_COLUMNS)
 
     logging.info("Nettoyage et typage terminés")
 
@@ -194,33 +529,107 @@ def main() -> None:
     # ============================================================
     logging.info("Étape 3 - Jointure et analyse")
 
-    # Jointure consultations ↔ patients
-    df_joined = df_consultations.merge(
-        df_patients[["patient_id"]],
-        on="patient_id",
-        how="left",
-        indicator=True,
+    # Rapprochement consultations ↔ patients
+    # Seule l'appartenance du `patient_id` à la table patients est utile :
+    # un test `isin` (une sonde de hachage par ligne) remplace la jointure,
+    # sans matérialiser la table jointe ni dupliquer de lignes si un
+    # `patient_id` apparaît plusieurs fois côté patients.
+    # Une consultation sans `patient_id` est comptée comme non valide : les
+    # identifiants nuls côté patients sont exclus de l'ensemble de référence
+    # (la jointure d'origine les appariait entre eux, nul avec nul).
+    # Les identifiants sont comparés via leur empreinte `uint64`.
+    is_valid_patient = membership_test(
+        np.unique(hash_identifier(df_patients["patient_id"].dropna()))
     )
 
-    # Indicateur de validité
-    df_joined["patient_valide"] = df_joined["_merge"] == "both"
-
-    # Extraire le mois
-    df_joined["mois_consultation"] = df_joined["date_consultation"].dt.to_period("M")
-
-    # Supprimer les consultations sans mois valide
-    df_joined = df_joined.dropna(subset=["mois_consultation"])
+    # Compteurs par mois, cumulés sur l'ensemble des blocs : nombre de
+    # consultations et nombre de patients valides.
+    # Les compteurs sont indexés par `clé - key_min` (plus petite clé vue)
+    # et ne couvrent donc que la plage de mois observée.
+    total = np.zeros(0, dtype=np.int64)
+    hits = np.zeros(0, dtype=np.int64)
+    key_min = None
+    nb_consultations = 0
+
+    # consultations.parquet est écrit au fil des blocs (groupes d'au plus
+    # `PARQUET_ROW_GROUP_SIZE` lignes, sans fusion d'un bloc à l'autre) :
+    # la table complète n'est jamais en mémoire.
+    outputs_dir.mkdir(parents=True, exist_ok=True)
 
-    # Conversion finale en string (pour affichage / export)
-    df_joined["mois_consultation"] = df_joined["mois_consultation"].astype(str)
-
-    # Calculer la proportion par mois 
-    resultat = (
-        df_joined
-        .groupby("mois_consultation")["patient_valide"]
-        .mean()
-        .reset_index(name="proportion_patient_id_valide")
-    )
+    consultations_schema = consultations_parquet_schema()
+
+    with pq.ParquetWriter(
+        outputs_dir / "consultations.parquet",
+        consultations_schema,
+        compression="snappy",
+        use_dictionary=True,
+        data_page_size=1 << 20,
+        write_statistics=False,
+    ) as writer:
+        for batch in consultations_batches:
+            df_consultations = clean_consultations(batch)
+            nb_consultations += len(df_consultations)
+
+            # Consultations sans date (donc sans mois) valide : exclues par
+            # un masque de nullité unique, appliqué aux seules colonnes
+            # utiles à l'analyse (pas de copie complète du bloc via `dropna`).
+            date_ok = df_consultations["date_consultation"].notna()
+            ts = df_consultations["date_consultation"][date_ok]
+
+            # Indicateur de validité
+            patient_id_h = hash_identifier(df_consultations["patient_id"][date_ok])
+            valid = is_valid_patient(patient_id_h).astype(np.uint8)
+
+            # Extraire le mois sous forme de clé entière (année * 12 + mois - 1)
+            # plutôt qu'en chaîne : clé de regroupement compacte en int32, seuls
+            # les mois distincts sont formatés en texte après agrégation.
+            keys = (
+                ts.dt.year.astype("int32") * 12 + ts.dt.month.astype("int32") - 1
+            ).to_numpy(dtype=np.int32)
+
+            # Cumul des compteurs par mois
+            # Clés entières et indicateur booléen : un décompte par clé
+            # suffit, sans passer par la machinerie générique du groupby
+            # pandas.
+            if keys.size:
+                # Clé plus ancienne que toutes les précédentes : les
+                # compteurs sont décalés vers la droite
+                batch_min = int(keys.min())
+                if key_min is None:
+                    key_min = batch_min
+                elif batch_min < key_min:
+                    shift = key_min - batch_min
+                    total = np.pad(total, (shift, 0))
+                    hits = np.pad(hits, (shift, 0))
+                    key_min = batch_min
+
+                batch_total, batch_hits = count_by_key(
+                    keys - key_min, valid, minlength=total.size
+                )
+                total = np.pad(total, (0, batch_total.size - total.size)) + batch_total
+                hits = np.pad(hits, (0, batch_hits.size - hits.size)) + batch_hits
+
+            writer.write_table(
+                pa.Table.from_pandas(
+                    df_consultations, schema=consultations_schema, preserve_index=False
+                ),
+                row_group_size=PARQUET_ROW_GROUP_SIZE,
+            )
+
+    logging.info("Consultations lues et traitées | %s lignes", nb_consultations)
+
+    # Calculer la proportion par mois
+    mois = np.flatnonzero(total)
+
+    # Conversion finale de la clé en string "AAAA-MM" (pour affichage / export)
+    # Le résultat ne compte qu'une ligne par mois : chaque mois distinct
+    # n'est formaté qu'une fois.
+    libelles = [f"{k // 12:04d}-{k % 12 + 1:02d}" for k in mois + (key_min or 0)]
+
+    resultat = pd.DataFrame({
+        "mois_consultation": libelles,
+        "proportion_patient_id_valide": hits[mois] / total[mois],
+    })
 
     logging.info("Analyse terminée | %s lignes produites", len(resultat))
 
@@ -229,11 +638,17 @@ def main() -> None:
     # ============================================================
     logging.info("Étape 4 - Sauvegarde au format Parquet")
 
-    outputs_dir.mkdir(parents=True, exist_ok=True)
+    # Compression Snappy + encodage dictionnaire (nombreuses valeurs
+    # répétées dans les colonnes texte / catégorielles).
+    write_parquet(df_patients, outputs_dir / "patients.parquet")
 
-    df_patients.to_parquet(outputs_dir / "patients.parquet", index=False)
-    df_consultations.to_parquet(outputs_dir / "consultations.parquet", index=False)
-    resultat.to_parquet(outputs_dir / "resultat_proportion.parquet", index=False)
+    # Table de résultat de petite taille : un seul groupe de lignes, Zstd
+    write_parquet(
+        resultat,
+        outputs_dir / "resultat_proportion.parquet",
+        compression="zstd",
+        row_group_size=max(len(resultat), 1),
+    )
 
     logging.info("Sauvegarde terminée")
     logging.info("===== FIN DU TRAITEMENT (SUCCESS) =====")